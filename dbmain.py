@@ -2,15 +2,29 @@ import os
 import sys
 import time
 import re
-import requests
+import asyncio
+import aiohttp
+from aiohttp_client_cache import CachedSession, SQLiteBackend
 import hashlib
 import logging
+from functools import lru_cache
 from datetime import datetime
 
 # --- CONFIGURATION ---
 TARGET_COUNTRY = "Romania"  # Set the target country here
 OUTPUT_FILE = f"{TARGET_COUNTRY}.m3u"
 PLACES_URL = "https://radio.garden/api/ara/content/places"
+MAX_CONCURRENCY = 50  # Upper bound on in-flight requests to radio.garden
+# Players follow radio.garden's 302 themselves; resolving costs one HEAD per channel.
+# Enable with `python dbmain.py --resolve` or RESOLVE_STREAMS=1.
+RESOLVE_STREAMS = "--resolve" in sys.argv or os.getenv("RESOLVE_STREAMS") == "1"
+# Places and channel pages barely change between runs; keep them in a local SQLite cache
+CACHE_NAME = "radio_garden_cache"
+CACHE_EXPIRE_SECONDS = 3600
+WRITE_BATCH = 1024  # Playlist entries joined per file write
+
+# Shared across all places so the whole scan respects MAX_CONCURRENCY
+REQUEST_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENCY)
 
 # --- HELPER FUNCTIONS ---
 
@@ -24,16 +38,16 @@ def setup_logging():
         handlers=[logging.StreamHandler(sys.stdout)]
     )
 
-def get_places(target_country):
+async def get_places(session, target_country):
     """
     Fetches all places and filters them by the target country.
     Returns a list of dicts: [{'id': '...', 'title': '...', 'geo': [...]}]
     """
     logging.info("Fetching list of all places...")
     try:
-        resp = requests.get(PLACES_URL, timeout=30)
-        resp.raise_for_status()
-        data = resp.json()
+        async with session.get(PLACES_URL, timeout=aiohttp.ClientTimeout(total=30)) as resp:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None)
         
         places_list = data.get('data', {}).get('list', [])
         
@@ -70,7 +84,7 @@ def extract_id_from_url(url_path):
         return None
 
 # --- NEW FUNCTION TO RESOLVE REDIRECT ---
-def get_final_stream_url(initial_url, channel_id):
+async def get_final_stream_url(session, initial_url, channel_id):
     """
     Executes a HEAD request on the initial stream URL to follow the 302 redirect
     and extract the final, playable stream URL from the 'location' header.
@@ -85,20 +99,23 @@ def get_final_stream_url(initial_url, channel_id):
     
     try:
         # Use HEAD request and prevent automatic redirects
-        resp = requests.head(initial_url, headers=headers, allow_redirects=False, timeout=10)
+        async with REQUEST_SEMAPHORE:
+            async with session.head(initial_url, headers=headers, allow_redirects=False,
+                                    timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                status = resp.status
+                final_url = resp.headers.get("location") # Extract the location header 
         
         # Check for 302 Found status code
-        if resp.status_code == 302:
-            final_url = resp.headers.get("location") # Extract the location header 
+        if status == 302:
             if final_url:
                 logging.info(f"Resolved stream URL for {channel_id}: {final_url}")
                 return final_url
             else:
                 logging.warning(f"302 status but no 'location' header for {channel_id}. Falling back to initial URL.")
         else:
-            logging.warning(f"Unexpected status code {resp.status_code} for {channel_id}. Falling back to initial URL.")
+            logging.warning(f"Unexpected status code {status} for {channel_id}. Falling back to initial URL.")
             
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         logging.error(f"Failed to resolve final stream URL for {channel_id}: {e}")
         
     # Fallback to the initial, unredirected URL
@@ -108,12 +125,16 @@ from urllib.parse import urlparse
 import os
 
 LOGO_DEV_TOKEN = os.getenv("LOGO_DEV_TOKEN", "pk_b0RiC-anSWOcvgBmS9Qy7Q")
+# Generic social media domains, matched on the last two labels of the website domain
+GENERIC_DOMAINS = frozenset({"facebook.com", "instagram.com", "twitter.com", "youtube.com", "t.co", "goo.gl"})
 
 # --- PROCESS HANDLERS ---
 
+@lru_cache(maxsize=4096)
 def get_logo_from_website(website_url):
     """
     Uses Clearbit Logo API to get a logo from the station's website domain.
+    Cached, since stations of the same network often share a website.
     """
     if not website_url:
         return None
@@ -128,8 +149,9 @@ def get_logo_from_website(website_url):
             domain = domain[4:]
             
         # Filter out generic social media domains to avoid getting Facebook/Insta logos
-        generic_domains = ["facebook.com", "instagram.com", "twitter.com", "youtube.com", "t.co", "goo.gl"]
-        if any(g in domain for g in generic_domains):
+        # hostname drops any port/userinfo and is lowercased
+        root_domain = ".".join((parsed.hostname or "").rsplit(".", 2)[-2:])
+        if root_domain in GENERIC_DOMAINS:
             return None
             
         if domain:
@@ -140,9 +162,9 @@ def get_logo_from_website(website_url):
         pass
     return None
 
-def get_channel_info(page, channel_unique_id, place_name=""):
+async def get_channel_info(session, page, channel_unique_id, place_name=""):
     """
-    Extracts relevant info for M3U and resolves the stream URL.
+    Extracts relevant info for M3U and, if RESOLVE_STREAMS is set, resolves the stream URL.
     """
     title = page.get("title", "Unknown Station")
     place = page.get("place", {}).get("title", place_name)
@@ -152,8 +174,11 @@ def get_channel_info(page, channel_unique_id, place_name=""):
     # Construct the initial stream URL
     initial_stream_url = f"https://radio.garden/api/ara/content/listen/{channel_unique_id}/channel.mp3"
     
-    # RESOLVE THE FINAL STREAM URL
-    final_stream_url = get_final_stream_url(initial_stream_url, channel_unique_id)
+    # RESOLVE THE FINAL STREAM URL (optional, the player can follow the redirect)
+    if RESOLVE_STREAMS:
+        final_stream_url = await get_final_stream_url(session, initial_stream_url, channel_unique_id)
+    else:
+        final_stream_url = initial_stream_url
     
     # GET LOGO FROM CLEARBIT
     logo_url = get_logo_from_website(website)
@@ -172,21 +197,25 @@ def get_channel_info(page, channel_unique_id, place_name=""):
         "city": place
     }
 
-def fetch_stations_from_place(place_id, place_name):
+async def fetch_stations_from_place(session, place_id, place_name, seen=None):
     """
     Fetches stations for a specific place ID.
+    All channels of the place are resolved concurrently.
+    Channels whose (title, channel_id) is already in `seen` are skipped.
     """
     url = f"https://radio.garden/api/ara/content/page/{place_id}/channels"
     stations = []
     
     try:
-        resp = requests.get(url, timeout=15)
-        if resp.status_code != 200:
-            return []
+        async with REQUEST_SEMAPHORE:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as resp:
+                if resp.status != 200:
+                    return []
+                data = await resp.json(content_type=None)
             
-        data = resp.json()
         content_list = data.get("data", {}).get("content", [])
         
+        tasks = []
         for section in content_list:
             items = section.get("items", [])
             for item in items:
@@ -194,9 +223,22 @@ def fetch_stations_from_place(place_id, place_name):
                 if page.get("type") == "channel":
                     raw_url = page.get("url", "")
                     channel_id = extract_id_from_url(raw_url)
-                    if channel_id:
-                        info = get_channel_info(page, channel_id, place_name)
-                        stations.append(info)
+                    if not channel_id:
+                        continue
+                    if seen is not None:
+                        key = (page.get("title", "Unknown Station"), channel_id)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                    tasks.append(get_channel_info(session, page, channel_id, place_name))
+        
+        # One bad channel must not discard the rest of the place
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for info in results:
+            if isinstance(info, Exception):
+                logging.warning(f"Error resolving a channel in {place_name}: {info}")
+            else:
+                stations.append(info)
                         
     except Exception as e:
         logging.warning(f"Error fetching stations for {place_name}: {e}")
@@ -204,63 +246,103 @@ def fetch_stations_from_place(place_id, place_name):
     return stations
 
 
-def process_full_country_scan(target_country):
+def format_m3u_entry(station):
+    """
+    Formats one station as its #EXTINF line plus stream URL line.
+    """
+    # Format: #EXTINF:-1 group-title="Country" tvg-logo="LogoURL",Title - City
+    display_title = f"{station['title']}" if station['city'] else station['title']
+    
+    return (f'#EXTINF:-1 group-title="{station["group_title"]}" tvg-logo="{station["logo_url"]}",{display_title}\n'
+            f'{station["stream_url"]}\n')
+
+async def process_full_country_scan(session, target_country, out):
     """
-    Scans all places in the country and aggregates stations.
+    Scans all places in the country concurrently and appends every new station
+    to the M3U file `out` (opened in binary mode) as soon as its place completes.
+    Returns an index {(title, stream_url): (offset, length)} of the entries written.
     """
-    places = get_places(target_country)
+    index = {}
+    
+    places = await get_places(session, target_country)
     if not places:
         logging.warning(f"No places found for {target_country}.")
-        return []
+        return index
     
-    all_stations = []
     total_places = len(places)
     
-    for idx, place in enumerate(places, 1):
+    logging.info(f"Scanning {total_places} places (max {MAX_CONCURRENCY} concurrent requests)...")
+    
+    # Shared by all places so a channel listed in several places is processed once
+    seen = set()
+    
+    async def scan_place(place):
         place_name = place.get('title')
-        place_id = place.get('id')
+        return place_name, await fetch_stations_from_place(session, place.get('id'), place_name, seen)
+    
+    tasks = [scan_place(p) for p in places]
+    
+    for idx, next_done in enumerate(asyncio.as_completed(tasks), 1):
+        try:
+            place_name, stations = await next_done
+        except Exception as e:
+            logging.warning(f"[{idx}/{total_places}] Error scanning a place: {e}")
+            continue
         
-        logging.info(f"[{idx}/{total_places}] Scanning: {place_name}...")
+        buf = []
+        offset = out.tell()
+        for station in stations:
+            # Remove duplicates based on title and stream_url; only keys and offsets stay in memory
+            key = (station['title'], station['stream_url'])
+            if key in index:
+                continue
+            entry = format_m3u_entry(station).encode('utf-8')
+            index[key] = (offset, len(entry))
+            offset += len(entry)
+            buf.append(entry)
         
-        stations = fetch_stations_from_place(place_id, place_name)
-        if stations:
-            all_stations.extend(stations)
-            
-        # Optional: slight delay to be nice to the API
-        # time.sleep(0.1) 
+        # Flush per place so partial output is usable if the scan is interrupted
+        out.write(b"".join(buf))
+        out.flush()
         
-    return all_stations
+        logging.info(f"[{idx}/{total_places}] {place_name}: {len(stations)} stations, {len(buf)} new")
+        
+    return index
 
-def save_to_m3u(stations, filename):
+def sort_m3u(source, filename, index):
     """
-    Saves the list of stations to an M3U file.
+    Copies the entries of the M3U file `source` to `filename`, sorted alphabetically by title.
+    `index` maps (title, stream_url) to the (offset, length) of each entry in `source`.
     """
-    # Remove duplicates based on title and stream_url
-    unique_stations = {}
-    for s in stations:
-        key = (s['title'], s['stream_url'])
-        if key not in unique_stations:
-            unique_stations[key] = s
-            
-    final_list = list(unique_stations.values())
-    
-    # Sort alphabetically by title since Radio Garden doesn't provide popularity metrics
-    final_list.sort(key=lambda x: x['title'])
-    
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write("#EXTM3U\n")
-        for station in final_list:
-            # Format: #EXTINF:-1 group-title="Country" tvg-logo="LogoURL",Title - City
-            display_title = f"{station['title']}" if station['city'] else station['title']
-            
-            line_info = f'#EXTINF:-1 group-title="{station["group_title"]}" tvg-logo="{station["logo_url"]}",{display_title}'
-            f.write(line_info + "\n")
-            f.write(station['stream_url'] + "\n")
-    
-    logging.info(f"Successfully saved {len(final_list)} unique stations to {filename}")
+    with open(source, 'rb') as src, open(filename, 'wb') as f:
+        f.write(b"#EXTM3U\n")
+        buf = []
+        # Sort alphabetically by title since Radio Garden doesn't provide popularity metrics
+        for key in sorted(index):
+            offset, length = index[key]
+            src.seek(offset)
+            buf.append(src.read(length))
+            if len(buf) >= WRITE_BATCH:
+                f.write(b"".join(buf))
+                buf.clear()
+        f.write(b"".join(buf))
 
 # --- EXECUTION ENTRY POINT ---
 
+async def run_scan(target_country, filename):
+    """
+    Runs the full country scan over a single pooled, cached HTTP session,
+    streaming stations into `filename`. Returns the index of the entries written.
+    """
+    # Only successful GETs are cached; the HEAD redirects are always fetched live
+    cache = SQLiteBackend(CACHE_NAME, expire_after=CACHE_EXPIRE_SECONDS, allowed_methods=("GET",))
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY, limit_per_host=10, ttl_dns_cache=300)
+    with open(filename, 'wb') as out:
+        out.write(b"#EXTM3U\n")
+        async with CachedSession(cache=cache, connector=connector) as session:
+            await session.cache.delete_expired_responses()
+            return await process_full_country_scan(session, target_country, out)
+
 def main_job():
     """
     Main function.
@@ -268,13 +350,19 @@ def main_job():
     setup_logging()
     
     logging.info(f"Starting FULL scan job for country: {TARGET_COUNTRY}")
+    if not RESOLVE_STREAMS:
+        logging.info("Stream URL resolution disabled (use --resolve to enable).")
     
-    stations = process_full_country_scan(TARGET_COUNTRY)
+    # Stations are streamed to a partial file; the previous playlist stays intact until the scan succeeds
+    partial_file = f"{OUTPUT_FILE}.part"
+    index = asyncio.run(run_scan(TARGET_COUNTRY, partial_file))
     
-    if stations:
-        save_to_m3u(stations, OUTPUT_FILE)
+    if index:
+        sort_m3u(partial_file, OUTPUT_FILE, index)
+        logging.info(f"Successfully saved {len(index)} unique stations to {OUTPUT_FILE}")
     else:
         logging.warning("No stations found.")
+    os.remove(partial_file)
 
     logging.info("Job complete.")
 
@@ -1,6 +1,9 @@
 import requests
+import orjson
 import urllib.parse
 from urllib.parse import urlparse
+from functools import lru_cache
+from operator import itemgetter
 import os
 
 # Configuration
@@ -8,10 +11,17 @@ TARGET_COUNTRY = "Romania"
 OUTPUT_FILE = f"Radio Browser - {TARGET_COUNTRY}.m3u"
 # Read from Environment Variable (for GitHub Actions) or use fallback (for local run)
 LOGO_DEV_TOKEN = os.getenv("LOGO_DEV_TOKEN", "pk_b0RiC-anSWOcvgBmS9Qy7Q")
+WRITE_BATCH = 1024  # Playlist entries joined per file write
+# Constant part of every #EXTINF line, encoded once
+EXTINF_PREFIX = f'#EXTINF:-1 group-title="{TARGET_COUNTRY}" radio="true"'.encode('utf-8')
+# Generic domains, matched on the last two labels of the website domain
+GENERIC_DOMAINS = frozenset({"facebook.com", "instagram.com", "twitter.com", "youtube.com", "t.co", "goo.gl", "shoutcast.com", "zeno.fm"})
 
+@lru_cache(maxsize=4096)
 def get_logo_from_website(website_url):
     """
     Uses img.logo.dev to get a logo from the station's website domain.
+    Cached, since stations of the same network often share a website.
     """
     if not website_url:
         return None
@@ -23,8 +33,9 @@ def get_logo_from_website(website_url):
         if domain.startswith("www."):
             domain = domain[4:]
             
-        generic_domains = ["facebook.com", "instagram.com", "twitter.com", "youtube.com", "t.co", "goo.gl", "shoutcast.com", "zeno.fm"]
-        if any(g in domain for g in generic_domains):
+        # hostname drops any port/userinfo and is lowercased
+        root_domain = ".".join((parsed.hostname or "").rsplit(".", 2)[-2:])
+        if root_domain in GENERIC_DOMAINS:
             return None
             
         if domain:
@@ -46,16 +57,23 @@ try:
     r.raise_for_status()
     
     if r.status_code == 200:
-        data = r.json()
+        # orjson parses the (multi-MB) station list much faster than stdlib json
+        data = orjson.loads(r.content)
         print(f"Found {len(data)} stations in {TARGET_COUNTRY}.")
         
         # Sort by popularity (clickcount) descending
         print("Sorting stations by popularity (clickcount)...")
-        data.sort(key=lambda x: int(x.get('clickcount', 0)), reverse=True)
+        # Normalize clickcount to int once so the sort key is a plain itemgetter
+        for item in data:
+            clickcount = item.get('clickcount')
+            if not isinstance(clickcount, int):
+                item['clickcount'] = int(clickcount or 0)
+        data.sort(key=itemgetter('clickcount'), reverse=True)
 
-        # Open file ONCE with UTF-8 encoding
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as file:
-            file.write("#EXTM3U\n")
+        # Open file ONCE in binary mode, entries are written as UTF-8 bytes
+        with open(OUTPUT_FILE, 'wb') as file:
+            file.write(b"#EXTM3U\n")
+            buf = []
 
             for item in data:
                 try:
@@ -79,10 +97,14 @@ try:
                         display_title += f" - {state}"
                     
                     if url:
-                        file.write(f'#EXTINF:-1 group-title="{TARGET_COUNTRY}" radio="true" tvg-logo="{logo}",{display_title}\n')
-                        file.write(f"{url}\n")
+                        buf.append(EXTINF_PREFIX + f' tvg-logo="{logo}",{display_title}\n{url}\n'.encode('utf-8'))
+                        if len(buf) >= WRITE_BATCH:
+                            file.write(b"".join(buf))
+                            buf.clear()
                 except Exception:
                     continue
+
+            file.write(b"".join(buf))
                     
         print(f"Done! Saved to {OUTPUT_FILE}")
 
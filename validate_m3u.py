@@ -1,37 +1,133 @@
 import sys
-import requests
+import socket
+import asyncio
 import concurrent.futures
+import httpx
+from tqdm import tqdm
+from collections import defaultdict
 from urllib.parse import urlparse
 import time
 
 # Configuration
-TIMEOUT_SECONDS = 3  # Maximum time to wait for a stream to respond
-MAX_WORKERS = 50     # Number of parallel checks (increase for speed, decrease for stability)
+TIMEOUT_SECONDS = 3      # Maximum time to wait for a stream to respond
+MAX_CONCURRENCY = 200    # Number of connections open at once (increase for speed, decrease for stability)
+MAX_PER_HOST = 6         # Requests at once against a single host (avoids self-inflicted 429s/timeouts)
+MAX_PER_REDIRECTOR = 32  # Requests at once against a host seen redirecting elsewhere (e.g. radio.garden)
+WRITE_BATCH = 1024       # Playlist entries joined per file write
+RETRY_STATUSES = {429, 502, 503, 504}  # Rate limiting and transient gateway errors, retried once before reporting dead
+RETRY_BACKOFF_SECONDS = 0.2
+DNS_TIMEOUT_SECONDS = 1  # Budget for the host pre-resolution pass
+DNS_WORKERS = 100        # Parallel getaddrinfo lookups
 
-def is_stream_playable(url):
+# getaddrinfo errors meaning the name definitely does not exist (EAI_NODATA is not on every platform)
+DNS_NOT_FOUND_ERRORS = {socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME)}
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body wrapper that frees the host slot once the response is closed."""
+    
+    def __init__(self, stream, host_sem):
+        self._stream = stream
+        self._host_sem = host_sem
+        self._released = False
+    
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+    
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._host_sem.release()
+
+def redirect_host(request, response):
+    """Returns the host a redirect response points to, or None if it has no usable location."""
+    location = response.headers.get("location")
+    if not location:
+        return None
+    try:
+        return request.url.join(location).host
+    except (httpx.InvalidURL, ValueError):
+        return None
+
+class HostLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Caps concurrent requests per host at the transport level.
+    Every redirect hop is limited on the host it actually connects to, so a
+    redirector in front of many streams doesn't throttle the streaming hosts.
+    Hosts seen redirecting to another host get the higher redirector cap.
+    """
+    
+    def __init__(self, transport, max_per_host, max_per_redirector):
+        self._transport = transport
+        self._host_sems = defaultdict(lambda: asyncio.Semaphore(max_per_host))
+        self._redirector_sems = defaultdict(lambda: asyncio.Semaphore(max_per_redirector))
+        self._redirectors = set()
+    
+    def _sem_for(self, host):
+        sems = self._redirector_sems if host in self._redirectors else self._host_sems
+        return sems[host]
+    
+    async def _acquire(self, host):
+        while True:
+            host_sem = self._sem_for(host)
+            await host_sem.acquire()
+            # The host may have been identified as a redirector while this request waited
+            if host_sem is self._sem_for(host):
+                return host_sem
+            host_sem.release()
+    
+    async def handle_async_request(self, request):
+        host = request.url.host
+        host_sem = await self._acquire(host)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            host_sem.release()
+            raise
+        
+        if 300 <= response.status_code < 400:
+            if redirect_host(request, response) not in (None, host):
+                self._redirectors.add(host)
+            # The redirect is answered; don't hold the slot while the client follows it
+            host_sem.release()
+            return response
+        
+        # The slot is held until the response is closed, not just until the headers arrive
+        response.stream = _ReleasingStream(response.stream, host_sem)
+        return response
+    
+    async def aclose(self):
+        await self._transport.aclose()
+
+async def is_stream_playable(client, url):
     """
     Rigorously tests if a URL is a valid audio stream.
     Checks: DNS/Connection, HTTP Status, Content-Type headers.
     """
     headers = {
-        "User-Agent": "VLC/3.0.18 LibVLC/3.0.18" # Mimic a real player
+        "User-Agent": "VLC/3.0.18 LibVLC/3.0.18", # Mimic a real player
+        # Many stream servers (Icecast, Shoutcast) reject HEAD, so a single
+        # ranged GET is used instead: one round trip that works everywhere
+        "Range": "bytes=0-1",
     }
-    
     try:
-        # 1. Try HEAD request first (lighter)
-        r = requests.head(url, headers=headers, timeout=TIMEOUT_SECONDS, allow_redirects=True)
-        
-        # If HEAD fails with 405 (Method Not Allowed) or similar, try GET
-        if r.status_code == 405 or r.status_code == 404:
-            r = requests.get(url, headers=headers, stream=True, timeout=TIMEOUT_SECONDS)
-            r.close() # Close connection immediately, we just need headers
+        # 1. Ranged GET; leaving the block closes the stream, we just need headers
+        for attempt in range(2):
+            async with client.stream("GET", url, headers=headers) as r:
+                status = r.status_code
+                content_type = r.headers.get('Content-Type', '').lower()
+            if status not in RETRY_STATUSES or attempt:
+                break
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS)
             
-        # 2. Check Status Code
-        if r.status_code >= 400:
-            return False, f"Status {r.status_code}"
+        # 2. Check Status Code (206 when the Range is honoured, 200 for live streams)
+        if status not in (200, 206):
+            return False, f"Status {status}"
 
         # 3. Check Content-Type (The rigorous part)
-        content_type = r.headers.get('Content-Type', '').lower()
         
         # Valid audio mime types
         valid_types = ['audio', 'ogg', 'video/mp2t', 'application/octet-stream'] 
@@ -48,13 +144,26 @@ def is_stream_playable(url):
 
         return True, "OK"
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         return False, "Timeout"
-    except requests.exceptions.ConnectionError:
+    except httpx.NetworkError:
         return False, "Connection Error"
     except Exception as e:
         return False, str(e)
 
+def url_host(url):
+    """Returns the hostname of `url` ('' if it has none), or None if the URL is malformed."""
+    try:
+        return urlparse(url).hostname or ""
+    except ValueError:
+        # e.g. "http://[broken/stream" (invalid IPv6 literal)
+        return None
+
+async def check_entry(client, entry):
+    """Validates one playlist entry and returns (entry, is_valid, reason)."""
+    is_valid, reason = await is_stream_playable(client, entry['url'])
+    return entry, is_valid, reason
+
 def parse_m3u(file_path):
     """Parses M3U file into a list of dicts."""
     entries = []
@@ -62,25 +171,24 @@ def parse_m3u(file_path):
     
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
+            # Iterate the file lazily instead of loading every line up front
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
                 
-            if line.startswith("#EXTINF"):
-                current_entry['extinf'] = line
-            elif line.startswith("#") and not line.startswith("#EXTM3U"):
-                # Preserve other tags like #EXTGRP if present
-                if 'tags' not in current_entry:
-                    current_entry['tags'] = []
-                current_entry['tags'].append(line)
-            elif not line.startswith("#"):
-                current_entry['url'] = line
-                if 'extinf' in current_entry: # Only add if we have metadata
-                    entries.append(current_entry)
-                current_entry = {} # Reset
+                if line.startswith("#EXTINF"):
+                    current_entry['extinf'] = line
+                elif line.startswith("#") and not line.startswith("#EXTM3U"):
+                    # Preserve other tags like #EXTGRP if present
+                    if 'tags' not in current_entry:
+                        current_entry['tags'] = []
+                    current_entry['tags'].append(line)
+                elif not line.startswith("#"):
+                    current_entry['url'] = line
+                    if 'extinf' in current_entry: # Only add if we have metadata
+                        entries.append(current_entry)
+                    current_entry = {} # Reset
                 
     except Exception as e:
         print(f"Error reading file: {e}")
@@ -88,6 +196,101 @@ def parse_m3u(file_path):
         
     return entries
 
+async def find_unresolvable_hosts(hosts):
+    """
+    Resolves all hosts concurrently and returns the set of hosts that do not exist
+    or are not valid host names. Lookups that time out or fail temporarily are not
+    included; those streams still get an HTTP check.
+    """
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=DNS_WORKERS)
+    # Admit lookups only as workers free up, so each one gets the full timeout
+    # rather than having its budget spent waiting in the executor queue
+    workers = asyncio.Semaphore(DNS_WORKERS)
+    
+    def lookup_finished(future):
+        # A timed-out lookup keeps its worker busy until getaddrinfo returns
+        workers.release()
+        if not future.cancelled():
+            future.exception() # Mark as retrieved; the caller may have stopped waiting
+    
+    async def resolves(host):
+        try:
+            await workers.acquire()
+            lookup = loop.run_in_executor(executor, socket.getaddrinfo, host, None)
+            lookup.add_done_callback(lookup_finished)
+            await asyncio.wait_for(asyncio.shield(lookup), DNS_TIMEOUT_SECONDS)
+        except socket.gaierror as e:
+            return e.errno not in DNS_NOT_FOUND_ERRORS
+        except (UnicodeError, ValueError):
+            # Malformed name (empty or over-long label) that the idna codec rejects
+            return False
+        except (asyncio.TimeoutError, OSError):
+            pass
+        return True
+    
+    try:
+        hosts = list(hosts)
+        results = await asyncio.gather(*(resolves(host) for host in hosts))
+        return {host for host, ok in zip(hosts, results) if not ok}
+    finally:
+        executor.shutdown(wait=False)
+
+async def validate_entries(entries):
+    """
+    Validates all entries concurrently on a single event loop.
+    Returns (valid_entries, dead_count).
+    """
+    valid_entries = []
+    dead_entries = 0
+    
+    # Parse every URL once; malformed ones are dead, as an HTTP check would report them
+    hosted = []
+    for entry in entries:
+        host = url_host(entry['url'])
+        if host is None:
+            dead_entries += 1
+        else:
+            hosted.append((host, entry))
+    if dead_entries:
+        print(f"Skipping {dead_entries} streams with malformed URLs.")
+    
+    # Fail fast on hosts that don't resolve instead of spending an HTTP slot on them
+    dead_hosts = await find_unresolvable_hosts({host for host, entry in hosted} - {""})
+    if dead_hosts:
+        resolvable = [(host, entry) for host, entry in hosted if host not in dead_hosts]
+        print(f"Skipping {len(hosted) - len(resolvable)} streams on {len(dead_hosts)} unresolvable hosts (DNS).")
+        dead_entries += len(hosted) - len(resolvable)
+        hosted = resolvable
+    
+    # HTTP/2 lets checks against the same host share one multiplexed connection
+    limits = httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=100)
+    transport = HostLimitedTransport(httpx.AsyncHTTPTransport(http2=True, limits=limits),
+                                     MAX_PER_HOST, MAX_PER_REDIRECTOR)
+    # Checks queue for a pooled connection without a deadline; each request keeps its own timeouts
+    timeout = httpx.Timeout(TIMEOUT_SECONDS, pool=None)
+    
+    # Start checks grouped by host so same-host checks run back to back
+    # and can share keep-alive (or HTTP/2) connections
+    by_host = [entry for host, entry in sorted(hosted, key=lambda he: he[0])]
+    
+    async with httpx.AsyncClient(transport=transport, timeout=timeout, follow_redirects=True) as client:
+        # Tasks are created here, in host order; as_completed would start bare coroutines in set order
+        tasks = [asyncio.create_task(check_entry(client, entry)) for entry in by_host]
+        
+        # tqdm refreshes on a timer, not on every completion
+        for next_done in tqdm(asyncio.as_completed(tasks), total=len(tasks), unit="stream"):
+            entry, is_valid, reason = await next_done
+        
+            if is_valid:
+                valid_entries.append(entry)
+            else:
+                dead_entries += 1
+                # Optional: Print dead streams
+                # print(f"DEAD: {entry['url']} -> {reason}")
+    
+    return valid_entries, dead_entries
+
 def validate_m3u_file(input_file):
     print(f"Reading {input_file}...")
     entries = parse_m3u(input_file)
@@ -96,40 +299,12 @@ def validate_m3u_file(input_file):
         print("No entries found or file error.")
         return
 
-    print(f"Found {len(entries)} streams. Validating with {MAX_WORKERS} threads...")
-    print(f"This might take about {len(entries) // MAX_WORKERS * TIMEOUT_SECONDS / 60:.1f} minutes.")
+    print(f"Found {len(entries)} streams. Validating with {MAX_CONCURRENCY} concurrent checks...")
+    print(f"This might take about {len(entries) // MAX_CONCURRENCY * TIMEOUT_SECONDS / 60:.1f} minutes.")
 
-    valid_entries = []
-    dead_entries = 0
-    
     start_time = time.time()
     
-    # Use ThreadPoolExecutor for parallel processing
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Create a dictionary to map futures to entries
-        future_to_entry = {executor.submit(is_stream_playable, entry['url']): entry for entry in entries}
-        
-        completed = 0
-        total = len(entries)
-        
-        for future in concurrent.futures.as_completed(future_to_entry):
-            entry = future_to_entry[future]
-            completed += 1
-            
-            # Simple progress bar
-            if completed % 50 == 0:
-                print(f"Progress: {completed}/{total} ({completed/total*100:.1f}%)")
-            
-            try:
-                is_valid, reason = future.result()
-                if is_valid:
-                    valid_entries.append(entry)
-                else:
-                    dead_entries += 1
-                    # Optional: Print dead streams
-                    # print(f"DEAD: {entry['url']} -> {reason}")
-            except Exception as exc:
-                dead_entries += 1
+    valid_entries, dead_entries = asyncio.run(validate_entries(entries))
 
     duration = time.time() - start_time
     
@@ -138,12 +313,15 @@ def validate_m3u_file(input_file):
     
     with open(output_file, 'w', encoding='utf-8') as f:
         f.write("#EXTM3U\n")
+        buf = []
         for entry in valid_entries:
-            f.write(f"{entry['extinf']}\n")
-            if 'tags' in entry:
-                for tag in entry['tags']:
-                    f.write(f"{tag}\n")
-            f.write(f"{entry['url']}\n")
+            # One buffer item per entry, so WRITE_BATCH counts entries
+            tags = "".join(f"{tag}\n" for tag in entry.get('tags', []))
+            buf.append(f"{entry['extinf']}\n{tags}{entry['url']}\n")
+            if len(buf) >= WRITE_BATCH:
+                f.write("".join(buf))
+                buf.clear()
+        f.write("".join(buf))
             
     print("-" * 30)
     print(f"Validation Complete in {duration:.1f} seconds.")